@@ -0,0 +1,59 @@
+"""compare two benchmark reports written by benchmarks.run
+
+    python -m benchmarks.compare baseline.json benchmark.json
+
+Prints the median time of each stage in both reports and their ratio,
+and exits with status 1 when a stage got slower than --threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load_stages(path):
+    with open(path) as f:
+        report = json.load(f)
+
+    return {
+        (run["points"], name): timing["median"]
+        for run in report["runs"]
+        for name, timing in run["stages"].items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="candidate/baseline ratio above which a stage is a regression",
+    )
+    args = parser.parse_args(argv)
+
+    baseline = load_stages(args.baseline)
+    candidate = load_stages(args.candidate)
+
+    regressions = []
+    for key in sorted(baseline.keys() & candidate.keys()):
+        points, name = key
+        ratio = candidate[key] / baseline[key] if baseline[key] else float("inf")
+        flag = ""
+        if ratio > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+
+        print(
+            f"{points:>10} {name:<40} "
+            f"{baseline[key] * 1000:10.1f} ms {candidate[key] * 1000:10.1f} ms "
+            f"{ratio:6.2f}x{flag}"
+        )
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""time each stage of the viewer data and render pipeline
+
+Builds a synthetic dataset and writes the timings as JSON, e.g.
+
+    python -m benchmarks.run --points 1e4 1e5 --output benchmark.json
+
+By default the data is written to a temporary SQLite database, which only
+times the boundary lookup, the bounding box query and the rendering; the
+region filter and facets of the pages need PostGIS and are listed under
+"skipped_stages" instead. Pass --database-uri to run against a local
+Postgres/PostGIS container, which is required for comparisons that
+reflect the pages. The tables are only dropped on SQLite, on databases
+named *bench*, or with --allow-drop.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.synthetic import build_dataset, check_drop_allowed
+from utils import (
+    get_country,
+    get_state,
+    lat_lon_inside_geom,
+    db_query_climatetrace,
+    db_facets_climatetrace,
+    db_facets_edgar,
+    render_region_figure,
+)
+
+# stages of the viewer pages that need PostGIS, skipped on SQLite
+POSTGIS_STAGES = [
+    "db_query_climatetrace_points_in_region",
+    "db_facets_climatetrace",
+    "db_facets_edgar",
+    "dataframe",
+]
+POSTGIS_REQUIRED = "requires PostGIS, run with --database-uri"
+
+
+def timed(repeat, func):
+    """call func repeat times
+
+    Returns
+    -------
+    timing: dict
+        seconds of each call and their summary
+    result: any
+        value returned by the last call
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+
+    timing = {
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "mean": statistics.mean(seconds),
+    }
+    return timing, result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scale(session, region_code, n_points, repeat, seed, allow_drop=False):
+    stages = {}
+    skipped = {}
+
+    get_boundary = get_state if "-" in region_code else get_country
+    stages["boundary"], polygon = timed(repeat, lambda: get_boundary(region_code))
+    west, south, east, north = polygon.bounds
+
+    start = time.perf_counter()
+    counts = build_dataset(
+        session,
+        polygon.bounds,
+        n_points,
+        iso=region_code,
+        seed=seed,
+        allow_drop=allow_drop,
+    )
+    build_seconds = time.perf_counter() - start
+
+    # the points drawn when "Show points outside" is checked
+    stages["db_query_climatetrace_points"], records = timed(
+        repeat,
+        lambda: db_query_climatetrace(
+            session, north, south, east, west, columns=("lat", "lon")
+        ),
+    )
+
+    if session.get_bind().dialect.name == "postgresql":
+        stages["db_query_climatetrace_points_in_region"], records_in_region = timed(
+            repeat,
+            lambda: db_query_climatetrace(
+                session,
+                north,
+                south,
+                east,
+                west,
+                geometry=polygon.wkt,
+                columns=("lat", "lon"),
+            ),
+        )
+        stages["db_facets_climatetrace"], facets = timed(
+            repeat,
+            lambda: db_facets_climatetrace(
+                session, polygon.wkt, north, south, east, west
+            ),
+        )
+        stages["db_facets_edgar"], _ = timed(
+            repeat,
+            lambda: db_facets_edgar(session, polygon.wkt, north, south, east, west),
+        )
+        stages["dataframe"], _ = timed(
+            repeat,
+            lambda: pd.DataFrame(
+                facets["pairs"], columns=["reference_number", "locode", "n_assets"]
+            )
+            .dropna(subset=["locode"])
+            .loc[:, ["locode", "reference_number", "n_assets"]]
+            .reset_index(drop=True),
+        )
+    else:
+        skipped = {name: POSTGIS_REQUIRED for name in POSTGIS_STAGES}
+        # untimed stand-in for the region filter, so the figure draws the
+        # same points as on PostGIS
+        records_in_region = [
+            record
+            for record in records
+            if lat_lon_inside_geom(record.lat, record.lon, polygon)
+        ]
+
+    lons = [record.lon for record in records_in_region]
+    lats = [record.lat for record in records_in_region]
+    stages["render_region_figure"], figure_png = timed(
+        repeat,
+        lambda: render_region_figure(
+            lons,
+            lats,
+            polygon,
+            extent=[west - 0.1, east + 0.1, south - 0.1, north + 0.1],
+            osm_background=False,
+        ),
+    )
+
+    return {
+        "points": n_points,
+        "build_seconds": build_seconds,
+        "rows": counts,
+        "records": len(records),
+        "records_in_region": len(records_in_region),
+        "figure_bytes": len(figure_png),
+        "stages": stages,
+        "skipped_stages": skipped,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--points",
+        nargs="+",
+        type=float,
+        default=[1e4],
+        help="number of synthetic assets, one run per value (e.g. 1e4 1e5 1e6)",
+    )
+    parser.add_argument("--region", default="AR", help="country or state ISO code")
+    parser.add_argument("--repeat", type=int, default=3, help="calls per stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--database-uri",
+        help="benchmark database, its asset, osm and EDGAR tables are dropped",
+    )
+    parser.add_argument(
+        "--allow-drop",
+        action="store_true",
+        help="drop the tables even if the database name doesn't contain 'bench'",
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_uri = args.database_uri or "sqlite:///" + os.path.join(
+            tmpdir, "benchmark.sqlite"
+        )
+        engine = create_engine(database_uri)
+        Session = sessionmaker(bind=engine)
+
+        try:
+            check_drop_allowed(engine, args.allow_drop)
+        except ValueError as e:
+            parser.error(str(e))
+
+        runs = []
+        for n_points in args.points:
+            with Session() as session:
+                run = run_scale(
+                    session,
+                    args.region,
+                    int(n_points),
+                    args.repeat,
+                    args.seed,
+                    args.allow_drop,
+                )
+                runs.append(run)
+
+        engine.dispose()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "dialect": engine.dialect.name,
+        "region": args.region,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "runs": runs,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for run in runs:
+        print(f"{run['points']} points")
+        for name, timing in run["stages"].items():
+            print(f"  {name:<40} {timing['median'] * 1000:10.1f} ms")
+        for name, reason in run["skipped_stages"].items():
+            print(f"  {name:<40} skipped, {reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import random
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text
+
+REFERENCE_NUMBERS = [
+    "I.1.1",
+    "I.2.1",
+    "I.3.1",
+    "II.1.1",
+    "II.2.1",
+    "III.1.1",
+    "III.2.1",
+    "IV.1",
+    "IV.2",
+    "V.1",
+]
+
+BATCH_SIZE = 10_000
+
+metadata = MetaData()
+
+asset = Table(
+    "asset",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lat", Float, index=True),
+    Column("lon", Float),
+    Column("filename", String),
+    Column("reference_number", String),
+    Column("locode", String),
+)
+
+osm = Table(
+    "osm",
+    metadata,
+    Column("locode", String, primary_key=True),
+    Column("geometry", Text),
+    Column("bbox_north", Float),
+    Column("bbox_south", Float),
+    Column("bbox_east", Float),
+    Column("bbox_west", Float),
+)
+
+grid_cell_edgar = Table(
+    "GridCellEdgar",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lat_center", Float, index=True),
+    Column("lon_center", Float),
+)
+
+city_cell_overlap_edgar = Table(
+    "CityCellOverlapEdgar",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("cell_id", Integer, index=True),
+    Column("locode", String),
+)
+
+grid_cell_emissions_edgar = Table(
+    "GridCellEmissionsEdgar",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("cell_id", Integer, index=True),
+    Column("reference_number", String),
+)
+
+
+def city_locodes(iso, n_cities):
+    return [f"{iso[:2].upper()} C{i:02d}" for i in range(n_cities)]
+
+
+def city_bounds(bounds, n_cities, rng):
+    """square city boundaries placed inside bounds
+
+    Returns
+    -------
+    cities: list
+        (west, south, east, north) of each city
+    """
+    west, south, east, north = bounds
+    size = min(east - west, north - south) / 20
+
+    cities = []
+    for _ in range(n_cities):
+        city_west = rng.uniform(west, east - size)
+        city_south = rng.uniform(south, north - size)
+        cities.append((city_west, city_south, city_west + size, city_south + size))
+
+    return cities
+
+
+def locode_at(lat, lon, cities, locodes):
+    for (west, south, east, north), locode in zip(cities, locodes):
+        if west <= lon <= east and south <= lat <= north:
+            return locode
+
+    return None
+
+
+def insert_batches(session, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            session.execute(table.insert(), batch)
+            batch = []
+
+    if batch:
+        session.execute(table.insert(), batch)
+
+
+def check_drop_allowed(engine, allow_drop=False):
+    """refuse to drop the viewer tables of a database that may be real
+
+    Dropping is allowed on SQLite, on databases whose name contains
+    "bench", or when allow_drop is set explicitly.
+    """
+    url = engine.url
+    if url.get_backend_name() == "sqlite" or "bench" in (url.database or ""):
+        return
+
+    if not allow_drop:
+        raise ValueError(
+            f"refusing to drop the asset, osm and EDGAR tables of database "
+            f"{url.database!r}; use a database named *bench* or pass --allow-drop"
+        )
+
+
+def build_dataset(
+    session, bounds, n_points, iso="AR", n_cities=20, seed=0, allow_drop=False
+):
+    """fill the asset, osm and EDGAR tables with synthetic data
+
+    Existing tables with the same names are dropped, see `check_drop_allowed`.
+
+    Parameters
+    ----------
+    session: sqlalchemy.orm.Session
+        session bound to the benchmark database
+    bounds: tuple
+        (west, south, east, north) of the region to fill, e.g. polygon.bounds
+    n_points: int
+        number of ClimateTRACE assets; one EDGAR cell is created per ten assets
+    iso: str
+        country code used to build the city locodes
+    n_cities: int
+        number of cities in the osm table
+    seed: int
+        random seed, the same arguments always produce the same dataset
+    allow_drop: bool
+        drop the tables even if the database doesn't look like a benchmark one
+
+    Returns
+    -------
+    counts: dict
+        number of rows written per table
+    """
+    rng = random.Random(seed)
+    west, south, east, north = bounds
+
+    engine = session.get_bind()
+    check_drop_allowed(engine, allow_drop)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    locodes = city_locodes(iso, n_cities)
+    cities = city_bounds(bounds, n_cities, rng)
+
+    insert_batches(
+        session,
+        osm,
+        (
+            {
+                "locode": locode,
+                "geometry": (
+                    f"POLYGON(({c_west} {c_south}, {c_east} {c_south}, "
+                    f"{c_east} {c_north}, {c_west} {c_north}, {c_west} {c_south}))"
+                ),
+                "bbox_north": c_north,
+                "bbox_south": c_south,
+                "bbox_east": c_east,
+                "bbox_west": c_west,
+            }
+            for locode, (c_west, c_south, c_east, c_north) in zip(locodes, cities)
+        ),
+    )
+
+    def assets():
+        for i in range(n_points):
+            lat = rng.uniform(south, north)
+            lon = rng.uniform(west, east)
+            yield {
+                "lat": lat,
+                "lon": lon,
+                "filename": f"asset_{i // 1000:05d}.csv",
+                "reference_number": rng.choice(REFERENCE_NUMBERS),
+                "locode": locode_at(lat, lon, cities, locodes),
+            }
+
+    insert_batches(session, asset, assets())
+
+    n_cells = max(n_points // 10, 1)
+    centers = [
+        (rng.uniform(south, north), rng.uniform(west, east)) for _ in range(n_cells)
+    ]
+
+    insert_batches(
+        session,
+        grid_cell_edgar,
+        (
+            {"id": cell_id, "lat_center": lat, "lon_center": lon}
+            for cell_id, (lat, lon) in enumerate(centers)
+        ),
+    )
+    # every fifth cell also overlaps a second city, as cells on a city
+    # border do, so facet counts have to count distinct cells
+    overlaps = []
+    for cell_id, (lat, lon) in enumerate(centers):
+        locode = locode_at(lat, lon, cities, locodes)
+        overlaps.append({"cell_id": cell_id, "locode": locode})
+        if cell_id % 5 == 0:
+            overlaps.append({"cell_id": cell_id, "locode": rng.choice(locodes)})
+
+    insert_batches(session, city_cell_overlap_edgar, overlaps)
+    insert_batches(
+        session,
+        grid_cell_emissions_edgar,
+        (
+            {"cell_id": cell_id, "reference_number": reference_number}
+            for cell_id in range(n_cells)
+            for reference_number in rng.sample(REFERENCE_NUMBERS, 3)
+        ),
+    )
+
+    session.commit()
+
+    return {
+        "asset": n_points,
+        "osm": n_cities,
+        "GridCellEdgar": n_cells,
+        "CityCellOverlapEdgar": len(overlaps),
+        "GridCellEmissionsEdgar": 3 * n_cells,
+    }
@@ -0,0 +1,335 @@
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# bump when the layout of cached values changes so replicas running
+# different image versions never read each other's entries
+CACHE_KEY_VERSION = 1
+CACHE_KEY_PREFIX = "dv"
+# entries are invalidated through the data versions in their keys, so they
+# can live for days
+DEFAULT_TTL = 7 * 24 * 60 * 60
+# total payload size kept by the in-process cache, the pod has 1Gi of memory
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+# how often each process re-reads the data versions from the database
+DATA_VERSION_INTERVAL = 60
+# seconds a Redis call may take before the cache is skipped for that call
+REDIS_SOCKET_TIMEOUT = 2
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(namespace: str, *parts):
+    """build a versioned cache key
+
+    Parameters
+    ----------
+    namespace: str
+        kind of value stored (e.g. "climatetrace", "boundary", "figure")
+    parts: any
+        values identifying the entry, hashed with their repr
+
+    Returns
+    -------
+    key: str
+        key of the form dv:v<version>:<namespace>:<digest>
+    """
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:v{CACHE_KEY_VERSION}:{namespace}:{digest}"
+
+
+def dumps(value):
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def loads(payload):
+    return pickle.loads(zlib.decompress(payload))
+
+
+class CacheBackend:
+    """interface shared by the cache implementations
+
+    Values are stored as compressed bytes, see `dumps` and `loads`.
+    """
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, payload: bytes, ttl: int = DEFAULT_TTL):
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, key: str, timeout: int = 60):
+        """serialize computation of a single key"""
+        yield
+
+    def load(self, key: str):
+        """return (hit, value) for key
+
+        A payload that can't be unpickled, e.g. one written by a replica
+        running other library versions, counts as a miss.
+        """
+        payload = self.get(key)
+        if payload is None:
+            return False, None
+
+        try:
+            return True, loads(payload)
+        except Exception:
+            return False, None
+
+    def get_or_set(self, key: str, compute, ttl: int = DEFAULT_TTL):
+        """return the cached value of key, computing and storing it on a miss
+
+        Concurrent misses on the same key are serialized with `lock`, so
+        only one caller (per process, or across replicas for a shared
+        backend) runs `compute`.
+        """
+        hit, value = self.load(key)
+        if hit:
+            return value
+
+        with self.lock(key):
+            hit, value = self.load(key)
+            if hit:
+                return value
+
+            value = compute()
+            self.set(key, dumps(value), ttl)
+
+        return value
+
+
+class InMemoryCache(CacheBackend):
+    """per-process LRU cache
+
+    Parameters
+    ----------
+    max_bytes: int
+        total size of the stored payloads, least recently used entries are
+        evicted beyond it and larger payloads are not stored at all
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._entries = OrderedDict()
+        self._mutex = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key):
+        with self._mutex:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, payload = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._pop(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload, ttl=DEFAULT_TTL):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._mutex:
+            self._pop(key)
+            if len(payload) > self.max_bytes:
+                return
+
+            self._entries[key] = (expires_at, payload)
+            self.n_bytes += len(payload)
+            while self.n_bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, *keys):
+        with self._mutex:
+            for key in keys:
+                self._pop(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.n_bytes -= len(entry[1])
+
+    @contextmanager
+    def lock(self, key, timeout=60):
+        with self._mutex:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        acquired = key_lock.acquire(timeout=timeout)
+        try:
+            yield
+        finally:
+            if acquired:
+                key_lock.release()
+            with self._mutex:
+                self._key_locks.pop(key, None)
+
+
+class RedisCache(CacheBackend):
+    """cache shared by all replicas, backed by a Redis-compatible server
+
+    Payloads are signed with an HMAC of the shared secret and unsigned or
+    tampered ones are misses, so a client that can write to the server can't
+    get arbitrary pickles loaded by the replicas. The server should still be
+    private to the deployment and require authentication.
+
+    The cache is an optimization: when the server is unreachable or slow,
+    reads are misses and writes are dropped instead of failing the page.
+
+    Parameters
+    ----------
+    uri: str
+        redis connection uri, e.g. redis://:password@dv-cache:6379/0
+    client: redis.Redis, optional
+        existing client, e.g. a fakeredis.FakeRedis instance for local testing
+    secret: bytes
+        key the payloads are signed with, the same on all replicas
+    """
+
+    def __init__(self, uri: str = None, client=None, secret: bytes = None):
+        if not secret:
+            raise ValueError("RedisCache needs a secret to sign payloads with")
+
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(
+                uri,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            )
+
+        self.client = client
+        self.secret = secret
+
+    def sign(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()
+
+    def get(self, key):
+        from redis import RedisError
+
+        try:
+            signed = self.client.get(key)
+        except RedisError as e:
+            logger.warning("cache get of %s failed: %s", key, e)
+            return None
+
+        if signed is None:
+            return None
+
+        signature, payload = signed[:32], signed[32:]
+        if not hmac.compare_digest(signature, self.sign(payload)):
+            logger.warning("cache entry %s has an invalid signature", key)
+            return None
+
+        return payload
+
+    def set(self, key, payload, ttl=DEFAULT_TTL):
+        from redis import RedisError
+
+        try:
+            self.client.set(key, self.sign(payload) + payload, ex=ttl or None)
+        except RedisError as e:
+            logger.warning("cache set of %s failed: %s", key, e)
+
+    def delete(self, *keys):
+        from redis import RedisError
+
+        if keys:
+            try:
+                self.client.delete(*keys)
+            except RedisError as e:
+                logger.warning("cache delete failed: %s", e)
+
+    @contextmanager
+    def lock(self, key, timeout=60):
+        # a lock that can't be acquired in time, or that expires while the
+        # value is computed, only costs a duplicate computation; LockError
+        # is a RedisError
+        from redis import RedisError
+
+        lock = self.client.lock(
+            f"{key}:lock", timeout=timeout, blocking_timeout=timeout
+        )
+        try:
+            acquired = lock.acquire()
+        except RedisError:
+            acquired = False
+
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except RedisError:
+                    pass
+
+
+_cache = None
+_data_versions = None
+_data_versions_fetched_at = None
+_data_versions_mutex = threading.Lock()
+
+
+def get_cache():
+    """return the process-wide cache backend
+
+    Uses Redis when the CACHE_URI environment variable is set, with payloads
+    signed with CACHE_SECRET, otherwise an in-process cache of at most
+    CACHE_MAX_BYTES bytes.
+    """
+    global _cache
+
+    if _cache is None:
+        cache_uri = os.environ.get("CACHE_URI")
+        if cache_uri:
+            secret = os.environ.get("CACHE_SECRET")
+            if not secret:
+                raise RuntimeError("CACHE_SECRET must be set when CACHE_URI is")
+            _cache = RedisCache(cache_uri, secret=secret.encode("utf-8"))
+        else:
+            max_bytes = int(os.environ.get("CACHE_MAX_BYTES") or DEFAULT_MAX_BYTES)
+            _cache = InMemoryCache(max_bytes)
+
+    return _cache
+
+
+def get_data_versions(fetch):
+    """return the data version of each source, refreshed periodically
+
+    Parameters
+    ----------
+    fetch: callable
+        returns a dict of source name to version, e.g. utils.db_data_versions
+
+    Returns
+    -------
+    versions: dict
+        last fetched versions, at most DATA_VERSION_INTERVAL seconds old
+    """
+    global _data_versions, _data_versions_fetched_at
+
+    with _data_versions_mutex:
+        now = time.monotonic()
+        if (
+            _data_versions is None
+            or now - _data_versions_fetched_at > DATA_VERSION_INTERVAL
+        ):
+            _data_versions = fetch()
+            _data_versions_fetched_at = now
+
+        return _data_versions
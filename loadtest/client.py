@@ -0,0 +1,195 @@
+"""headless client of a running streamlit server
+
+Speaks the same websocket protocol as the browser: a session sends a
+`rerun_script` BackMsg with its widget values and reads ForwardMsgs until
+the script run finishes, then downloads the images of the run the way the
+browser does.
+"""
+import asyncio
+import time
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.NumberInput_pb2 import NumberInput
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.websocket import WebSocketError, websocket_connect
+
+WIDGET_TYPES = {"text_input", "number_input", "checkbox", "multiselect"}
+
+
+class ScriptRunError(Exception):
+    pass
+
+
+# errors of the server connection, reported as a failed script run
+CONNECTION_ERRORS = (HTTPClientError, WebSocketError, OSError)
+
+
+class Session:
+    """one browser tab connected to the app
+
+    Parameters
+    ----------
+    base_url: str
+        http url of the server, e.g. http://localhost:8501
+    page_name: str
+        multipage page to run, e.g. "Country_Viewer"
+    """
+
+    def __init__(self, base_url, page_name):
+        self.base_url = base_url.rstrip("/")
+        self.page_name = page_name
+        self.widgets = {}
+        self.widget_values = {}
+        self._connection = None
+        self._message_cache = {}
+        self._http = AsyncHTTPClient()
+
+    async def connect(self):
+        """open the websocket, raises ScriptRunError when that fails"""
+        ws_url = "ws" + self.base_url[len("http"):] + "/_stcore/stream"
+        try:
+            self._connection = await websocket_connect(ws_url)
+        except CONNECTION_ERRORS as e:
+            raise ScriptRunError(f"connect failed: {e!r}")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def set_widget(self, label, value):
+        """set the value of a widget seen in the last run, by label"""
+        if label not in self.widgets:
+            raise LookupError(f"no widget labelled {label!r}")
+
+        self.widget_values[label] = value
+
+    def widget_value(self, label):
+        if label in self.widget_values:
+            return self.widget_values[label]
+
+        return self.widgets[label]["default"]
+
+    def back_msg(self):
+        msg = BackMsg()
+        msg.rerun_script.page_name = self.page_name
+
+        for label, value in self.widget_values.items():
+            widget = self.widgets[label]
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget["id"]
+
+            if widget["type"] == "checkbox":
+                state.bool_value = value
+            elif widget["type"] == "number_input" and widget["int"]:
+                state.int_value = int(value)
+            elif widget["type"] == "number_input":
+                state.double_value = float(value)
+            elif widget["type"] == "text_input":
+                state.string_value = value
+
+        return msg
+
+    async def rerun(self, timeout):
+        """run the page with the current widget values
+
+        Returns
+        -------
+        seconds: float
+            time until the script finished and its images were downloaded
+
+        Raises
+        ------
+        ScriptRunError
+            when the page raised an exception, the run didn't finish, or the
+            connection or an image download failed
+        """
+        start = time.perf_counter()
+        deadline = start + timeout
+
+        try:
+            await self._connection.write_message(
+                self.back_msg().SerializeToString(), binary=True
+            )
+        except CONNECTION_ERRORS as e:
+            raise ScriptRunError(f"send failed: {e!r}")
+
+        image_urls = []
+        exceptions = []
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise ScriptRunError("timed out")
+
+            payload = await self._read(remaining)
+            if payload is None:
+                raise ScriptRunError("connection closed")
+
+            msg = ForwardMsg()
+            msg.ParseFromString(payload)
+            msg = self._resolve(msg)
+            msg_type = msg.WhichOneof("type")
+
+            if msg_type == "delta":
+                self._read_delta(msg.delta, image_urls, exceptions)
+            elif msg_type == "page_not_found":
+                raise ScriptRunError(f"page {self.page_name!r} not found")
+            elif msg_type == "script_finished":
+                if msg.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY:
+                    raise ScriptRunError(
+                        ForwardMsg.ScriptFinishedStatus.Name(msg.script_finished)
+                    )
+                break
+
+        for url in image_urls:
+            try:
+                await self._http.fetch(self.base_url + url, request_timeout=timeout)
+            except CONNECTION_ERRORS as e:
+                raise ScriptRunError(f"image download failed: {e!r}")
+
+        if exceptions:
+            raise ScriptRunError(exceptions[0])
+
+        return time.perf_counter() - start
+
+    async def _read(self, timeout):
+        try:
+            return await asyncio.wait_for(self._connection.read_message(), timeout)
+        except asyncio.TimeoutError:
+            raise ScriptRunError("timed out")
+
+    def _resolve(self, msg):
+        # messages seen before in this session may arrive as a reference
+        if msg.WhichOneof("type") == "ref_hash":
+            return self._message_cache[msg.ref_hash]
+
+        if msg.metadata.cacheable:
+            self._message_cache[msg.hash] = msg
+
+        return msg
+
+    def _read_delta(self, delta, image_urls, exceptions):
+        if delta.WhichOneof("type") != "new_element":
+            return
+
+        element = delta.new_element
+        element_type = element.WhichOneof("type")
+
+        if element_type in WIDGET_TYPES:
+            widget = getattr(element, element_type)
+            self.widgets[widget.label] = {
+                "id": widget.id,
+                "type": element_type,
+                "default": getattr(widget, "default", None),
+                "int": (
+                    element_type == "number_input"
+                    and widget.data_type == NumberInput.INT
+                ),
+            }
+        elif element_type == "imgs":
+            image_urls.extend(
+                image.url for image in element.imgs.imgs if image.url.startswith("/")
+            )
+        elif element_type == "exception":
+            exceptions.append(f"{element.exception.type}: {element.exception.message}")
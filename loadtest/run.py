@@ -0,0 +1,457 @@
+"""drive concurrent viewer sessions and report latency and resource use
+
+Starts the app with `streamlit run` (or uses --url) and connects N headless
+websocket clients to it. Each client opens a viewer page and goes through a
+realistic flow (change region, toggle the background map, tweak the marker
+style), e.g.
+
+    python -m loadtest.run --sessions 1 2 4 8 --cpus 0 --output loadtest.json
+
+Latency is measured on the client, from sending the widget change until the
+script run finished and its figure was downloaded, so it is what a user
+waits for. RSS is that of the server process. Database connections are
+those opened with the server's application_name (PGAPPNAME), which excludes
+other replicas, the loader and interactive clients; they are reported in
+total, including idle pooled ones, and those running a query.
+
+The server keeps its cache between levels, so levels after the first run
+mostly warm. Use --cpus to pin the server to the CPUs of the pod limit; the
+clients should run on other CPUs.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from sqlalchemy import create_engine, text
+
+from loadtest.client import ScriptRunError, Session
+
+PAGES = {
+    "country": {
+        "page_name": "Country_Viewer",
+        "region_label": "Region ISO Code:",
+        "regions": ["AR", "BR", "CL", "MX", "DE"],
+    },
+    "state": {
+        "page_name": "State_Viewer",
+        "region_label": "State ISO Code:",
+        "regions": ["US-CA", "US-NY", "US-TX", "US-WA", "US-FL"],
+    },
+    "city": {
+        "page_name": "City_Viewer",
+        "region_label": "City LOCODE:",
+        "regions": ["US NYC", "US LAX", "US CHI", "US SFO", "US SEA"],
+    },
+}
+
+MARKER_COLORS = ["red", "blue", "black", "orange"]
+
+
+def change_region(session, page, rng):
+    session.set_widget(page["region_label"], rng.choice(page["regions"]))
+
+
+def toggle_background(session, page, rng):
+    label = "Show background map"
+    session.set_widget(label, not session.widget_value(label))
+
+
+def tweak_style(session, page, rng):
+    session.set_widget("Marker color", rng.choice(MARKER_COLORS))
+    session.set_widget("Marker size", rng.randrange(5, 50, 5))
+
+
+FLOW = [change_region, toggle_background, tweak_style]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else None,
+    }
+
+
+def rss_bytes(pid):
+    """current resident set size of a process, None if unknown"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+class ResourceSampler(threading.Thread):
+    """periodically record the server RSS and its database connections"""
+
+    def __init__(self, server_pid, database_uri, application_name, interval=0.5):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.application_name = application_name
+        self.interval = interval
+        self.rss = []
+        self.db_connections = []
+        self.db_connections_active = []
+        self._stop_event = threading.Event()
+        self._engine = None
+        if database_uri:
+            self._engine = create_engine(database_uri, pool_size=1)
+
+    def db_connection_count(self, connection):
+        """number of connections of the server, and of those running a query
+
+        Idle connections kept by the pool count towards the first number
+        only.
+        """
+        query = text(
+            """
+            SELECT
+                count(*) AS total,
+                count(*) FILTER (WHERE state = 'active') AS active
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+            AND application_name = :application_name;
+            """
+        )
+        params = {"application_name": self.application_name}
+        row = connection.execute(query, params).one()
+        return row.total, row.active
+
+    def run(self):
+        connection = None
+        if self._engine is not None:
+            try:
+                connection = self._engine.connect()
+            except Exception:
+                connection = None
+
+        while not self._stop_event.is_set():
+            if self.server_pid is not None:
+                rss = rss_bytes(self.server_pid)
+                if rss is not None:
+                    self.rss.append(rss)
+            if connection is not None:
+                try:
+                    total, active = self.db_connection_count(connection)
+                    self.db_connections.append(total)
+                    self.db_connections_active.append(active)
+                except Exception:
+                    connection.close()
+                    connection = None
+            self._stop_event.wait(self.interval)
+
+        if connection is not None:
+            connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self):
+        return {
+            "server_rss_max_bytes": max(self.rss) if self.rss else None,
+            "server_rss_mean_bytes": statistics.mean(self.rss) if self.rss else None,
+            "db_connections_max": max(self.db_connections, default=None),
+            "db_connections_mean": (
+                statistics.mean(self.db_connections) if self.db_connections else None
+            ),
+            "db_connections_active_max": max(self.db_connections_active, default=None),
+            "db_connections_active_mean": (
+                statistics.mean(self.db_connections_active)
+                if self.db_connections_active
+                else None
+            ),
+        }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, cpus, application_name, timeout=60):
+    """start the app with `streamlit run`, pinned to cpus when given
+
+    Returns
+    -------
+    process: subprocess.Popen
+        the server, its pid is that of the streamlit process
+    """
+    command = [
+        sys.executable,
+        "-m",
+        "streamlit",
+        "run",
+        "Homepage.py",
+        "--server.headless=true",
+        f"--server.port={port}",
+        "--browser.gatherUsageStats=false",
+    ]
+    if cpus:
+        command = ["taskset", "-c", cpus] + command
+
+    env = dict(os.environ, PGAPPNAME=application_name)
+    process = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    health_url = f"http://localhost:{port}/_stcore/health"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"streamlit exited with status {process.returncode}")
+        try:
+            with urllib.request.urlopen(health_url, timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError(f"streamlit didn't become healthy within {timeout}s")
+
+
+async def run_session(session_id, base_url, page_name, iterations, timeout, seed):
+    """run one session through the flow of a page
+
+    A session that hits an error reconnects and starts over with a fresh
+    page load, like a user reloading the tab.
+
+    Returns
+    -------
+    samples: list
+        (page, action, seconds, error) for each script run
+    """
+    rng = random.Random(seed + session_id)
+    page = PAGES[page_name]
+    samples = []
+
+    async def timed_rerun(session, action):
+        start = time.perf_counter()
+        try:
+            seconds = await session.rerun(timeout)
+            samples.append((page_name, action, seconds, None))
+            return True
+        except ScriptRunError as e:
+            samples.append((page_name, action, time.perf_counter() - start, str(e)))
+            return False
+
+    async def load():
+        session = Session(base_url, page["page_name"])
+        try:
+            await session.connect()
+        except ScriptRunError as e:
+            samples.append((page_name, "load", 0.0, str(e)))
+            return None
+
+        if not await timed_rerun(session, "load"):
+            session.close()
+            return None
+
+        return session
+
+    session = await load()
+    for _ in range(iterations):
+        for step in FLOW:
+            if session is None:
+                session = await load()
+                if session is None:
+                    continue
+
+            try:
+                step(session, page, rng)
+            except LookupError as e:
+                samples.append((page_name, step.__name__, 0.0, str(e)))
+                continue
+
+            if not await timed_rerun(session, step.__name__):
+                session.close()
+                session = None
+
+    if session is not None:
+        session.close()
+
+    return samples
+
+
+async def run_sessions(n_sessions, base_url, pages, iterations, timeout, seed):
+    results = await asyncio.gather(
+        *(
+            run_session(
+                session_id,
+                base_url,
+                pages[session_id % len(pages)],
+                iterations,
+                timeout,
+                seed,
+            )
+            for session_id in range(n_sessions)
+        )
+    )
+    return [sample for samples in results for sample in samples]
+
+
+def run_level(n_sessions, base_url, pages, iterations, timeout, seed, sampler):
+    sampler.start()
+
+    start = time.perf_counter()
+    samples = asyncio.run(
+        run_sessions(n_sessions, base_url, pages, iterations, timeout, seed)
+    )
+    elapsed = time.perf_counter() - start
+
+    sampler.stop()
+
+    ok_latencies = [seconds for _, _, seconds, error in samples if error is None]
+    by_action = {}
+    errors = {}
+    for page_name, action, seconds, error in samples:
+        if error is None:
+            by_action.setdefault(f"{page_name}/{action}", []).append(seconds)
+        else:
+            errors[error] = errors.get(error, 0) + 1
+
+    return {
+        "sessions": n_sessions,
+        "elapsed_seconds": elapsed,
+        "reruns": len(samples),
+        "errors": sum(errors.values()),
+        "error_messages": errors,
+        "throughput_per_second": len(ok_latencies) / elapsed if elapsed else None,
+        "latency_seconds": summarize(ok_latencies),
+        "latency_seconds_by_action": {
+            key: summarize(values) for key, values in sorted(by_action.items())
+        },
+        **sampler.summary(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sessions",
+        nargs="+",
+        type=int,
+        default=[1, 2, 4, 8],
+        help="number of concurrent sessions, one run per value",
+    )
+    parser.add_argument(
+        "--pages",
+        nargs="+",
+        choices=sorted(PAGES),
+        default=sorted(PAGES),
+        help="pages the sessions are spread over",
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=3, help="passes through the flow per session"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="seconds allowed per script run"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--url",
+        help="already running server; by default one is started with streamlit run",
+    )
+    parser.add_argument(
+        "--server-pid", type=int, help="pid of the --url server, to sample its RSS"
+    )
+    parser.add_argument(
+        "--cpus", help="CPUs the started server is pinned to with taskset, e.g. 0"
+    )
+    parser.add_argument(
+        "--application-name",
+        default="dv-loadtest",
+        help="PGAPPNAME of the server, used to count its database connections",
+    )
+    parser.add_argument("--output", default="loadtest.json")
+    args = parser.parse_args(argv)
+
+    database_uri = os.environ.get("DATABASE_URI") or "postgresql://ccglobal:@localhost/ccglobal"
+
+    server = None
+    if args.url:
+        base_url = args.url
+        server_pid = args.server_pid
+    else:
+        port = free_port()
+        server = start_server(port, args.cpus, args.application_name)
+        base_url = f"http://localhost:{port}"
+        server_pid = server.pid
+
+    levels = []
+    try:
+        for n_sessions in args.sessions:
+            sampler = ResourceSampler(server_pid, database_uri, args.application_name)
+            level = run_level(
+                n_sessions,
+                base_url,
+                args.pages,
+                args.iterations,
+                args.timeout,
+                args.seed,
+                sampler,
+            )
+            levels.append(level)
+
+            latency = level["latency_seconds"]
+            rss = level["server_rss_max_bytes"]
+            print(
+                f"{n_sessions:>4} sessions: "
+                f"p50 {latency['p50'] or 0:.2f}s p95 {latency['p95'] or 0:.2f}s "
+                f"p99 {latency['p99'] or 0:.2f}s, "
+                f"{level['throughput_per_second'] or 0:.2f} reruns/s, "
+                f"{level['errors']} errors, "
+                f"server rss {rss / 2**20 if rss else 0:.0f} MiB, "
+                f"db connections {level['db_connections_max']} "
+                f"({level['db_connections_active_max']} active)"
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+        # written even when a level crashed, with the levels that finished
+        report = {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "url": base_url,
+            "server_cpus": args.cpus,
+            "application_name": args.application_name,
+            "pages": args.pages,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "cache": "redis" if os.environ.get("CACHE_URI") else "in-process",
+            "levels": levels,
+        }
+
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
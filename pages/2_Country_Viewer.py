@@ -1,22 +1,18 @@
-import cartopy.crs as ccrs
-from cartopy.mpl.geoaxes import GeoAxes
-from cartopy.io.img_tiles import OSM
-import cartopy.feature as cfeature
-from matplotlib.patches import Polygon as mplPolygon
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import AxesGrid
 import pandas as pd
-import shapely.geometry as geom
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.orm import sessionmaker
 import streamlit as st
 import os
 
+from cache import get_cache, get_data_versions, make_key
 from utils import (
+    data_version,
+    db_data_versions,
     get_country,
-    lat_lon_inside_geom,
     db_query_climatetrace,
-    db_query_edgar_by_range
+    db_facets_climatetrace,
+    db_facets_edgar,
+    render_region_figure,
 )
 
 with st.sidebar:
@@ -78,148 +74,159 @@ with st.container():
     engine = create_engine(database_uri)
     metadata_obj = MetaData()
     Session = sessionmaker(bind=engine)
+    cache = get_cache()
 
     with Session() as session:
-        polygon = get_country(region_code)
-        west, south, east, north = polygon.bounds
-
-        records = db_query_climatetrace(session, north, south, east, west)
-
-        records_in_geom = [
-            record
-            for record in records
-            if lat_lon_inside_geom(record.lat, record.lon, polygon)
-        ]
+        data_versions = get_data_versions(lambda: db_data_versions(session))
+        climatetrace_version = data_version(data_versions, "climatetrace", region_code)
+        edgar_version = data_version(data_versions, "edgar", region_code)
 
-        records_edgar = db_query_edgar_by_range(session, north, south, east, west)
+        polygon = cache.get_or_set(
+            make_key("boundary", "country", region_code.upper()),
+            lambda: get_country(region_code),
+        )
+        west, south, east, north = polygon.bounds
 
-        edgar_records_in_geom = [
-            record
-            for record in records_edgar
-            if lat_lon_inside_geom(record.lat, record.lon, polygon)
-        ]
+        facets_all = cache.get_or_set(
+            make_key(
+                "climatetrace_facets",
+                climatetrace_version,
+                "country",
+                region_code.upper(),
+            ),
+            lambda: db_facets_climatetrace(
+                session, polygon.wkt, north, south, east, west
+            ),
+        )
 
-        if show_outside_point:
-            lons = [record.lon for record in records]
-            lats = [record.lat for record in records]
+        with st.sidebar:
+            st.markdown("""---""")
+            st.subheader("Sectors")
+            selected_reference_numbers = st.multiselect(
+                "Reference numbers (all when empty)",
+                options=sorted(
+                    reference_number
+                    for reference_number in facets_all["reference_number"]
+                    if reference_number is not None
+                ),
+            )
+
+        sector_filter = sorted(selected_reference_numbers) or None
+
+        if sector_filter is None:
+            facets = facets_all
         else:
-            lons = [record.lon for record in records_in_geom]
-            lats = [record.lat for record in records_in_geom]
+            facets = cache.get_or_set(
+                make_key(
+                    "climatetrace_facets",
+                    climatetrace_version,
+                    "country",
+                    region_code.upper(),
+                    sector_filter,
+                ),
+                lambda: db_facets_climatetrace(
+                    session, polygon.wkt, north, south, east, west, sector_filter
+                ),
+            )
+
+        facets_edgar = cache.get_or_set(
+            make_key(
+                "edgar_facets",
+                edgar_version,
+                "country",
+                region_code.upper(),
+                sector_filter,
+            ),
+            lambda: db_facets_edgar(
+                session, polygon.wkt, north, south, east, west, sector_filter
+            ),
+        )
 
-        reference_numbers = set(
-            sorted([record.reference_number for record in records_in_geom])
+        # only the points that are drawn: the whole bounding box when points
+        # outside the region are shown, otherwise the region itself
+        region_geometry = None if show_outside_point else polygon.wkt
+        records = cache.get_or_set(
+            make_key(
+                "climatetrace_points",
+                climatetrace_version,
+                north,
+                south,
+                east,
+                west,
+                sector_filter,
+                None if show_outside_point else region_code.upper(),
+            ),
+            lambda: db_query_climatetrace(
+                session,
+                north,
+                south,
+                east,
+                west,
+                sector_filter,
+                region_geometry,
+                columns=("lat", "lon"),
+            ),
         )
 
-    imagery = OSM()
+        lons = [record.lon for record in records]
+        lats = [record.lat for record in records]
+
+        reference_numbers = set(facets["reference_number"])
 
     # ==========================
     # Figure
     # ==========================
-    facecolor = [0, 0, 0]
-    edgecolor = "black"
-    alpha = 0.2
-
-    central_longitude = 11
-    continent_color = [0.3, 0.3, 0.3]
-    coastline_color = [0.25, 0.25, 0.25]
-    coastline_width: float = 0.5
-    color = marker_color
-    marker = "o"
-    s = marker_size
-    edgecolor = edge_color
-    linewidth = edge_width
-
-    fig = plt.figure(dpi=300)
-
-    if osm_background:
-        projection = imagery.crs
-    else:
-        projection = ccrs.Robinson(central_longitude=central_longitude)
-
-    params_axesgrid = {
-        "rect": [1, 1, 1],
-        "axes_class": (GeoAxes, dict(projection=projection)),
-        "share_all": False,
-        "nrows_ncols": (1, 1),
-        "axes_pad": 0.1,
-        "cbar_location": "bottom",
-        "cbar_mode": None,
-        "cbar_pad": 0.1,
-        "cbar_size": "7%",
-        "label_mode": "",
+    figure_params = {
+        "extent": [west - lon_pad, east + lon_pad, south - lat_pad, north + lat_pad],
+        "osm_background": osm_background,
+        "map_resolution": map_resolution,
+        "marker_color": marker_color,
+        "marker_size": marker_size,
+        "edge_color": edge_color,
+        "edge_width": edge_width,
     }
-
-    grid = AxesGrid(fig, **params_axesgrid)
-
-    grid[0].scatter(
-        lons,
-        lats,
-        transform=ccrs.PlateCarree(),
-        color=color,
-        marker=marker,
-        zorder=2,
-        s=s,
-        edgecolor=edgecolor,
-        linewidth=linewidth,
+    figure_png = cache.get_or_set(
+        make_key(
+            "figure",
+            "country",
+            region_code.upper(),
+            climatetrace_version,
+            sector_filter,
+            show_outside_point,
+            sorted(figure_params.items()),
+        ),
+        lambda: render_region_figure(lons, lats, polygon, **figure_params),
     )
 
-    grid[0].set_extent(
-        [west - lon_pad, east + lon_pad, south - lat_pad, north + lat_pad],
-        crs=ccrs.PlateCarree(),
-    )
-
-    polygon_params = {
-        "edgecolor": edgecolor,
-        "facecolor": facecolor,
-        "alpha": alpha,
-        "linewidth": 1,
-        "transform": ccrs.PlateCarree(),
-    }
-
-    try:
-        boundary = mplPolygon(polygon.exterior.coords, **polygon_params)
-        grid[0].add_patch(boundary)
-    except:
-        for geom in polygon.geoms:
-            boundary = mplPolygon(geom.exterior.coords, **polygon_params)
-            grid[0].add_patch(boundary)
-
-    if osm_background:
-        grid[0].add_image(imagery, map_resolution)
-    else:
-        grid[0].add_feature(cfeature.LAND)
-
     # ==========================
     # Additional information
     # ==========================
-    df_tmp = pd.DataFrame(records_in_geom)
     df_locodes_climatetrace = (
-        df_tmp.loc[df_tmp[4].notnull(), [4, 3]]
-        .drop_duplicates()
-        .sort_values(by=[3, 4])
+        pd.DataFrame(
+            facets["pairs"], columns=["reference_number", "locode", "n_assets"]
+        )
+        .dropna(subset=["locode"])
+        .loc[:, ["locode", "reference_number", "n_assets"]]
         .reset_index(drop=True)
-        .rename(columns={3: "reference_number", 4: "locode"})
     )
+    n_cities_climatetrace = sum(1 for locode in facets["locode"] if locode is not None)
 
-    n_cities_climatetrace = len(df_locodes_climatetrace["locode"].drop_duplicates())
-
-    df_tmp = pd.DataFrame(edgar_records_in_geom)
     df_locodes_edgar = (
-        df_tmp.loc[df_tmp[3].notnull(), [3, 2]]
-        .drop_duplicates()
-        .sort_values(by=[2, 3])
+        pd.DataFrame(
+            facets_edgar["pairs"], columns=["reference_number", "locode", "n_cells"]
+        )
+        .dropna(subset=["locode"])
+        .loc[:, ["locode", "reference_number", "n_cells"]]
         .reset_index(drop=True)
-        .rename(columns={2: "reference_number", 3: "locode"})
     )
-    n_cities_edgar = len(df_locodes_edgar["locode"].drop_duplicates())
+    n_cities_edgar = sum(1 for locode in facets_edgar["locode"] if locode is not None)
 
     st.header(f"Assets within {region_code}")
 
     with st.expander("See Figure"):
-        st.pyplot(fig)
+        st.image(figure_png, use_column_width=True)
 
-    st.write(f"Number of assets: {len(records_in_geom)}")
-    #st.write(f"Number of EDGAR cells: {len(edgar_records_in_geom)}")
+    st.write(f"Number of assets: {sum(facets['reference_number'].values())}")
     st.write(f"Number of cities with data (climateTRACE): {n_cities_climatetrace}")
     st.write(f"Number of cities with data (EDGAR): {n_cities_edgar}")
     st.write(f"Reference numbers: {reference_numbers}")
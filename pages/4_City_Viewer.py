@@ -1,21 +1,17 @@
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-from cartopy.mpl.geoaxes import GeoAxes
-from cartopy.io.img_tiles import OSM
-import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon as mplPolygon
-from mpl_toolkits.axes_grid1 import AxesGrid
-import shapely.geometry as geom
 from shapely import wkt
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.orm import sessionmaker
 import streamlit as st
 import os
 
+from cache import get_cache, get_data_versions, make_key
 from utils import (
+    data_version,
+    db_data_versions,
     locode_data,
-    lat_lon_inside_geom,
     db_query_climatetrace,
+    db_facets_climatetrace,
+    render_region_figure,
 )
 
 with st.sidebar:
@@ -75,9 +71,17 @@ with st.container():
     engine = create_engine(database_uri)
     metadata_obj = MetaData()
     Session = sessionmaker(bind=engine)
+    cache = get_cache()
 
     with Session() as session:
-        records_tmp = locode_data(session, locode)
+        data_versions = get_data_versions(lambda: db_data_versions(session))
+        climatetrace_version = data_version(data_versions, "climatetrace", locode)
+        osm_version = data_version(data_versions, "osm", locode)
+
+        records_tmp = cache.get_or_set(
+            make_key("osm", osm_version, locode),
+            lambda: locode_data(session, locode),
+        )
         records = {
             "geometry": records_tmp[0][0],
             "bbox_north": records_tmp[0][1],
@@ -91,107 +95,112 @@ with st.container():
         east = records["bbox_east"] + lon_pad
         west = records["bbox_west"] - lon_pad
 
-        results = db_query_climatetrace(session, north, south, east, west)
-
-    imagery = OSM()
-
-    facecolor = [0, 0, 0]
-    edgecolor = "black"
-    alpha = 0.2
-
-    polygon_wkt = records["geometry"]
-    polygon = wkt.loads(polygon_wkt)
-
-    # filter records
-    records_in_geom = [
-        record
-        for record in results
-        if lat_lon_inside_geom(record.lat, record.lon, polygon)
-    ]
-
-    # plot records
-    if show_outside_point:
-        lons = [record.lon for record in results]
-        lats = [record.lat for record in results]
-    else:
-        lons = [record.lon for record in records_in_geom]
-        lats = [record.lat for record in records_in_geom]
-
-    reference_numbers = set(
-        sorted([record.reference_number for record in records_in_geom])
-    )
-
-    central_longitude = 11
-    continent_color = [0.3, 0.3, 0.3]
-    coastline_color = [0.25, 0.25, 0.25]
-    coastline_width: float = 0.5
-    color = marker_color
-    marker = "o"
-    s = marker_size
-    edgecolor = edge_color
-    linewidth = edge_width
-
-    fig = plt.figure(dpi=300)
-
-    if osm_background:
-        projection = imagery.crs
-    else:
-        projection = ccrs.Robinson(central_longitude=central_longitude)
-
-    params_axesgrid = {
-        "rect": [1, 1, 1],
-        "axes_class": (GeoAxes, dict(projection=projection)),
-        "share_all": False,
-        "nrows_ncols": (1, 1),
-        "axes_pad": 0.1,
-        "cbar_location": "bottom",
-        "cbar_mode": None,
-        "cbar_pad": 0.1,
-        "cbar_size": "7%",
-        "label_mode": "",
+        polygon_wkt = records["geometry"]
+        polygon = wkt.loads(polygon_wkt)
+
+        facets_all = cache.get_or_set(
+            make_key(
+                "climatetrace_facets",
+                climatetrace_version,
+                osm_version,
+                "city",
+                locode,
+            ),
+            lambda: db_facets_climatetrace(
+                session, polygon_wkt, north, south, east, west
+            ),
+        )
+
+        with st.sidebar:
+            st.markdown("""---""")
+            st.subheader("Sectors")
+            selected_reference_numbers = st.multiselect(
+                "Reference numbers (all when empty)",
+                options=sorted(
+                    reference_number
+                    for reference_number in facets_all["reference_number"]
+                    if reference_number is not None
+                ),
+            )
+
+        sector_filter = sorted(selected_reference_numbers) or None
+
+        if sector_filter is None:
+            facets = facets_all
+        else:
+            facets = cache.get_or_set(
+                make_key(
+                    "climatetrace_facets",
+                    climatetrace_version,
+                    osm_version,
+                    "city",
+                    locode,
+                    sector_filter,
+                ),
+                lambda: db_facets_climatetrace(
+                    session, polygon_wkt, north, south, east, west, sector_filter
+                ),
+            )
+
+        # only the points that are drawn: the whole bounding box when points
+        # outside the region are shown, otherwise the region itself
+        region_geometry = None if show_outside_point else polygon_wkt
+        results = cache.get_or_set(
+            make_key(
+                "climatetrace_points",
+                climatetrace_version,
+                osm_version,
+                north,
+                south,
+                east,
+                west,
+                sector_filter,
+                None if show_outside_point else locode,
+            ),
+            lambda: db_query_climatetrace(
+                session,
+                north,
+                south,
+                east,
+                west,
+                sector_filter,
+                region_geometry,
+                columns=("lat", "lon"),
+            ),
+        )
+
+    lons = [record.lon for record in results]
+    lats = [record.lat for record in results]
+
+    reference_numbers = set(facets["reference_number"])
+
+    figure_params = {
+        "extent": [west, east, south, north],
+        "osm_background": osm_background,
+        "map_resolution": map_resolution,
+        "marker_color": marker_color,
+        "marker_size": marker_size,
+        "edge_color": edge_color,
+        "edge_width": edge_width,
     }
-
-    grid = AxesGrid(fig, **params_axesgrid)
-
-    grid[0].scatter(
-        lons,
-        lats,
-        transform=ccrs.PlateCarree(),
-        color=color,
-        marker=marker,
-        zorder=2,
-        s=marker_size,
-        edgecolor=edgecolor,
-        linewidth=linewidth,
+    figure_png = cache.get_or_set(
+        make_key(
+            "figure",
+            "city",
+            locode,
+            climatetrace_version,
+            osm_version,
+            sector_filter,
+            show_outside_point,
+            sorted(figure_params.items()),
+        ),
+        lambda: render_region_figure(lons, lats, polygon, **figure_params),
     )
 
-    grid[0].set_extent([west, east, south, north], crs=ccrs.PlateCarree())
-
-    polygon_params = {
-        "edgecolor": edgecolor,
-        "facecolor": facecolor,
-        "alpha": alpha,
-        "linewidth": 1,
-        "transform": ccrs.PlateCarree(),
-    }
-
-    try:
-        boundary = mplPolygon(polygon.exterior.coords, **polygon_params)
-        grid[0].add_patch(boundary)
-    except:
-        for geom in polygon.geoms:
-            boundary = mplPolygon(geom.exterior.coords, **polygon_params)
-            grid[0].add_patch(boundary)
-
-    if osm_background:
-        grid[0].add_image(imagery, map_resolution)
-    else:
-        grid[0].add_feature(cfeature.LAND)
-
     st.header(f"Assets within {locode}")
 
     with st.expander("See Figure"):
-        st.pyplot(fig)
+        st.image(figure_png, use_column_width=True)
 
-    st.write(f"Number of assets: {len(records_in_geom)}")
-    st.write(f"Reference numbers: {reference_numbers}")
\ No newline at end of file
+    st.write(f"Number of assets: {sum(facets['reference_number'].values())}")
+    st.write(f"Reference numbers: {reference_numbers}")
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from benchmarks.synthetic import check_drop_allowed
+
+
+def engine_for(uri):
+    # only the url is inspected, so no database driver is needed
+    return SimpleNamespace(url=make_url(uri))
+
+
+def test_check_drop_allowed_on_sqlite():
+    check_drop_allowed(create_engine("sqlite://"))
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        "postgresql://ccglobal:@localhost/ccglobal_bench",
+        "postgresql://ccglobal:@localhost/bench",
+    ],
+)
+def test_check_drop_allowed_on_bench_database(uri):
+    check_drop_allowed(engine_for(uri))
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        "postgresql://ccglobal:@localhost/ccglobal",
+        "postgresql://ccglobal:@localhost",
+    ],
+)
+def test_check_drop_refused_on_other_database(uri):
+    with pytest.raises(ValueError, match="--allow-drop"):
+        check_drop_allowed(engine_for(uri))
+
+
+def test_check_drop_allowed_with_allow_drop():
+    check_drop_allowed(
+        engine_for("postgresql://ccglobal:@localhost/ccglobal"), allow_drop=True
+    )
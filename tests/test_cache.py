@@ -0,0 +1,189 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+from redis import ConnectionError as RedisConnectionError
+
+import cache
+from cache import InMemoryCache, RedisCache, dumps, make_key
+
+SECRET = b"test secret"
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return InMemoryCache()
+
+    return RedisCache(client=fakeredis.FakeRedis(), secret=SECRET)
+
+
+def test_get_or_set_round_trip(backend):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"rows": [(1.0, 2.0, "I.1.1", None)]}
+
+    key = make_key("test", "round-trip")
+    assert backend.get_or_set(key, compute) == {"rows": [(1.0, 2.0, "I.1.1", None)]}
+    assert backend.get_or_set(key, compute) == {"rows": [(1.0, 2.0, "I.1.1", None)]}
+    assert len(calls) == 1
+
+
+def test_get_or_set_caches_none(backend):
+    calls = []
+
+    def compute():
+        calls.append(1)
+
+    key = make_key("test", "none")
+    assert backend.get_or_set(key, compute) is None
+    assert backend.get_or_set(key, compute) is None
+    assert len(calls) == 1
+
+
+def test_concurrent_misses_compute_once(backend):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "value"
+
+    key = make_key("test", "concurrent")
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(backend.get_or_set(key, compute)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_ttl(backend):
+    key = make_key("test", "ttl")
+    backend.set(key, dumps("value"), ttl=1)
+    assert backend.get(key) is not None
+
+    time.sleep(1.1)
+    assert backend.get(key) is None
+
+
+def test_key_versioning(backend, monkeypatch):
+    key_v1 = make_key("test", "versioned")
+    backend.set(key_v1, dumps("old layout"))
+
+    monkeypatch.setattr(cache, "CACHE_KEY_VERSION", cache.CACHE_KEY_VERSION + 1)
+    key_v2 = make_key("test", "versioned")
+
+    assert key_v1 != key_v2
+    assert backend.get_or_set(key_v2, lambda: "new layout") == "new layout"
+
+
+def test_corrupt_payload_is_a_miss(backend):
+    key = make_key("test", "corrupt")
+    backend.set(key, b"not a pickle")
+
+    assert backend.get_or_set(key, lambda: "value") == "value"
+    assert backend.get_or_set(key, lambda: "other") == "value"
+
+
+def test_lru_eviction_by_size():
+    payload = b"x" * 100
+    backend = InMemoryCache(max_bytes=250)
+
+    backend.set("a", payload)
+    backend.set("b", payload)
+    backend.get("a")
+    backend.set("c", payload)
+
+    assert backend.get("a") == payload
+    assert backend.get("b") is None
+    assert backend.get("c") == payload
+    assert backend.n_bytes == 200
+
+
+def test_oversized_payload_is_not_stored():
+    backend = InMemoryCache(max_bytes=10)
+    backend.set("a", b"x" * 11)
+
+    assert backend.get("a") is None
+    assert backend.n_bytes == 0
+
+
+def test_redis_lock_expiry_keeps_computed_value():
+    backend = RedisCache(client=fakeredis.FakeRedis(), secret=SECRET)
+    key = make_key("test", "lock-expiry")
+
+    def compute():
+        # outlives the lock, so releasing it fails
+        backend.client.delete(f"{key}:lock")
+        return "value"
+
+    assert backend.get_or_set(key, compute) == "value"
+    assert backend.get_or_set(key, lambda: "other") == "value"
+
+
+def test_redis_lock_timeout_computes_without_lock():
+    backend = RedisCache(client=fakeredis.FakeRedis(), secret=SECRET)
+    key = make_key("test", "lock-timeout")
+    backend.client.set(f"{key}:lock", b"held by another replica")
+
+    computed = []
+    with backend.lock(key, timeout=0.1):
+        computed.append(1)
+
+    assert computed == [1]
+
+
+def test_redis_unsigned_payload_is_a_miss():
+    backend = RedisCache(client=fakeredis.FakeRedis(), secret=SECRET)
+    key = make_key("test", "unsigned")
+    backend.client.set(key, dumps("injected"))
+
+    assert backend.get(key) is None
+    assert backend.get_or_set(key, lambda: "value") == "value"
+
+
+def test_redis_payload_signed_with_other_secret_is_a_miss():
+    client = fakeredis.FakeRedis()
+    key = make_key("test", "other-secret")
+    RedisCache(client=client, secret=b"other secret").set(key, dumps("injected"))
+
+    backend = RedisCache(client=client, secret=SECRET)
+    assert backend.get_or_set(key, lambda: "value") == "value"
+
+
+def test_redis_needs_a_secret():
+    with pytest.raises(ValueError):
+        RedisCache(client=fakeredis.FakeRedis())
+
+
+def test_redis_from_url_sets_timeouts():
+    backend = RedisCache("redis://localhost:6379/0", secret=SECRET)
+    kwargs = backend.client.connection_pool.connection_kwargs
+
+    assert kwargs["socket_timeout"] == cache.REDIS_SOCKET_TIMEOUT
+    assert kwargs["socket_connect_timeout"] == cache.REDIS_SOCKET_TIMEOUT
+
+
+def test_redis_unavailable_computes_without_cache():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    backend = RedisCache(client=fakeredis.FakeRedis(server=server), secret=SECRET)
+    key = make_key("test", "unavailable")
+
+    with pytest.raises(RedisConnectionError):
+        backend.client.ping()
+
+    assert backend.get(key) is None
+    backend.set(key, dumps("value"))
+    backend.delete(key)
+    assert backend.get_or_set(key, lambda: "value") == "value"
@@ -0,0 +1,238 @@
+import logging
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import asset, metadata
+from utils import (
+    ASSET_COLUMNS,
+    DATA_SOURCES,
+    data_version,
+    db_data_versions,
+    db_query_climatetrace,
+    split_facets,
+)
+
+FacetRow = namedtuple("FacetRow", ["reference_number", "locode", "facet", "n"])
+VersionRow = namedtuple("VersionRow", ["source", "region", "version"])
+StatRow = namedtuple("StatRow", ["relname", "n_changes", "started_at", "stats_reset"])
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalar(self):
+        return self.rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeSession:
+    """answers the queries of db_data_versions in order"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((str(query), params))
+        return Result(self.results.pop(0))
+
+
+VERSIONS = {
+    "climatetrace": {None: "10", "AR": "12", "US": "15"},
+    "edgar": {None: "3"},
+    "osm": {},
+}
+
+
+def test_data_version_of_source():
+    assert data_version(VERSIONS, "climatetrace") == "10"
+
+
+def test_data_version_uses_country_of_state_and_city():
+    assert data_version(VERSIONS, "climatetrace", "AR") == "10|12"
+    assert data_version(VERSIONS, "climatetrace", "us-ca") == "10|15"
+    assert data_version(VERSIONS, "climatetrace", "US NYC") == "10|15"
+
+
+def test_data_version_missing_region():
+    assert data_version(VERSIONS, "climatetrace", "BR") == "10|0"
+    assert data_version(VERSIONS, "edgar", "AR") == "3|0"
+
+
+def test_data_version_missing_source():
+    assert data_version(VERSIONS, "osm", "AR") == "0|0"
+    assert data_version({}, "climatetrace", "AR") == "0|0"
+    assert data_version({}, "climatetrace") == "0"
+
+
+def test_data_version_changes_only_for_reloaded_country():
+    reloaded = {
+        **VERSIONS,
+        "climatetrace": {**VERSIONS["climatetrace"], "AR": "16"},
+    }
+
+    assert data_version(reloaded, "climatetrace", "AR") != data_version(
+        VERSIONS, "climatetrace", "AR"
+    )
+    assert data_version(reloaded, "climatetrace", "US-CA") == data_version(
+        VERSIONS, "climatetrace", "US-CA"
+    )
+
+
+def test_db_data_versions_from_watermarks():
+    session = FakeSession(
+        True,
+        [
+            VersionRow("climatetrace", None, 10),
+            VersionRow("climatetrace", "AR", 12),
+            VersionRow("edgar", "US", 3),
+            VersionRow("unknown", None, 7),
+        ],
+    )
+
+    assert db_data_versions(session) == {
+        "climatetrace": {None: "10", "AR": "12"},
+        "edgar": {"US": "3"},
+        "osm": {},
+    }
+
+
+def test_db_data_versions_fallback(caplog):
+    session = FakeSession(
+        False,
+        [
+            StatRow("asset", 100, "2026-01-01 00:00:00", None),
+            StatRow("GridCellEdgar", 5, "2026-01-01 00:00:00", None),
+        ],
+    )
+
+    with caplog.at_level(logging.WARNING, logger="utils"):
+        versions = db_data_versions(session)
+
+    assert "data_version table is missing" in caplog.text
+    assert set(versions) == set(DATA_SOURCES)
+    assert all(list(regions) == [None] for regions in versions.values())
+    assert versions["climatetrace"][None] == "2026-01-01 00:00:00:None:100"
+    assert versions["edgar"][None] == "2026-01-01 00:00:00:None:5|0|0"
+    assert versions["osm"][None] == "0"
+
+    # no wall-clock component, so the versions only change with the data
+    query, params = session.queries[1]
+    assert "now()" not in query
+    assert sorted(params["tables"]) == sorted(
+        table for tables in DATA_SOURCES.values() for table in tables
+    )
+
+
+def test_split_facets():
+    rows = [
+        FacetRow("I.1.1", "AR BUE", 0, 3),
+        FacetRow("I.1.1", None, 0, 2),
+        FacetRow("II.1.1", "AR BUE", 0, 1),
+        FacetRow("I.1.1", None, 1, 5),
+        FacetRow("II.1.1", None, 1, 1),
+        FacetRow(None, "AR BUE", 2, 4),
+        FacetRow(None, None, 2, 2),
+    ]
+
+    assert split_facets(rows) == {
+        "reference_number": {"I.1.1": 5, "II.1.1": 1},
+        "locode": {"AR BUE": 4, None: 2},
+        "pairs": [
+            ("I.1.1", "AR BUE", 3),
+            ("I.1.1", None, 2),
+            ("II.1.1", "AR BUE", 1),
+        ],
+    }
+
+
+def test_split_facets_null_reference_number():
+    # assets without a reference number are their own group, not the
+    # grand total of GROUPING SETS
+    rows = [
+        FacetRow(None, "AR BUE", 0, 2),
+        FacetRow(None, None, 1, 2),
+        FacetRow(None, "AR BUE", 2, 2),
+    ]
+
+    assert split_facets(rows) == {
+        "reference_number": {None: 2},
+        "locode": {"AR BUE": 2},
+        "pairs": [(None, "AR BUE", 2)],
+    }
+
+
+def test_split_facets_empty():
+    assert split_facets([]) == {"reference_number": {}, "locode": {}, "pairs": []}
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine, tables=[asset])
+    with Session(engine) as session:
+        session.execute(
+            asset.insert(),
+            [
+                dict(zip(ASSET_COLUMNS, row))
+                for row in [
+                    (1.0, 1.0, "a.csv", "I.1.1", "AR BUE"),
+                    (1.0, 1.0, "b.csv", "I.1.1", "AR BUE"),
+                    (2.0, 2.0, "a.csv", "II.1.1", None),
+                    (3.0, 3.0, "a.csv", "III.1.1", None),
+                    (9.0, 9.0, "a.csv", "I.1.1", None),
+                ]
+            ],
+        )
+        yield session
+
+
+def test_db_query_climatetrace_bounding_box(session):
+    records = db_query_climatetrace(session, 5, 0, 5, 0)
+
+    assert sorted((r.lat, r.filename, r.reference_number) for r in records) == [
+        (1.0, "a.csv", "I.1.1"),
+        (1.0, "b.csv", "I.1.1"),
+        (2.0, "a.csv", "II.1.1"),
+        (3.0, "a.csv", "III.1.1"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "reference_numbers, expected",
+    [
+        (["I.1.1"], [1.0, 1.0]),
+        (["I.1.1", "III.1.1"], [1.0, 1.0, 3.0]),
+        ({"II.1.1"}, [2.0]),
+        (["V.1"], []),
+    ],
+)
+def test_db_query_climatetrace_reference_numbers(
+    session, reference_numbers, expected
+):
+    records = db_query_climatetrace(session, 5, 0, 5, 0, reference_numbers)
+
+    assert sorted(record.lat for record in records) == expected
+
+
+def test_db_query_climatetrace_columns(session):
+    records = db_query_climatetrace(session, 5, 0, 5, 0, columns=("lat", "lon"))
+
+    assert sorted(tuple(record) for record in records) == [
+        (1.0, 1.0),
+        (2.0, 2.0),
+        (3.0, 3.0),
+    ]
+    assert list(records[0]._fields) == ["lat", "lon"]
+
+
+@pytest.mark.parametrize("columns", [(), ("lat", "lon; DROP TABLE asset")])
+def test_db_query_climatetrace_rejects_unknown_columns(session, columns):
+    with pytest.raises(ValueError):
+        db_query_climatetrace(session, 5, 0, 5, 0, columns=columns)
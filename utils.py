@@ -1,6 +1,28 @@
+import io
+import logging
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
 import cartopy.io.shapereader as shpreader
+from cartopy.io.img_tiles import OSM
+from cartopy.mpl.geoaxes import GeoAxes
+import matplotlib.pyplot as plt
+from matplotlib.patches import Polygon as mplPolygon
+from mpl_toolkits.axes_grid1 import AxesGrid
 from shapely.geometry import Point
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
+
+# tables backing each data source, used to track when a source is reloaded
+DATA_SOURCES = {
+    "climatetrace": ["asset"],
+    "edgar": ["GridCellEdgar", "CityCellOverlapEdgar", "GridCellEmissionsEdgar"],
+    "osm": ["osm"],
+}
+
+# columns of the asset table returned by db_query_climatetrace
+ASSET_COLUMNS = ("lat", "lon", "filename", "reference_number", "locode")
+
+logger = logging.getLogger(__name__)
 
 
 def get_country(iso: str):
@@ -48,23 +70,139 @@ def lat_lon_inside_geom(lat, lon, geometry):
     return point.within(geometry)
 
 
-def db_query_climatetrace(session, north, south, east, west):
-    query = text(
+def db_query_climatetrace(
+    session,
+    north,
+    south,
+    east,
+    west,
+    reference_numbers=None,
+    geometry=None,
+    columns=ASSET_COLUMNS,
+):
+    """ClimateTRACE assets inside a bounding box
+
+    Parameters
+    ----------
+    north, south, east, west: float
+        bounding box
+    reference_numbers: list, optional
+        only return assets of these reference numbers
+    geometry: str, optional
+        only return assets inside this region boundary, in well-known-text
+        format; requires PostGIS
+    columns: tuple, optional
+        columns of the asset table to return, e.g. ("lat", "lon") for the
+        figure; rows are distinct over these columns only
+    """
+    unknown = set(columns) - set(ASSET_COLUMNS)
+    if not columns or unknown:
+        raise ValueError(f"columns must be taken from {ASSET_COLUMNS}")
+
+    filters = ""
+    if reference_numbers is not None:
+        filters += "AND reference_number IN :reference_numbers\n"
+    if geometry is not None:
+        filters += """
+        AND ST_Within(
+            ST_SetSRID(ST_MakePoint(lon, lat), 4326),
+            ST_GeomFromText(:geometry, 4326)
+        )
         """
-        SELECT DISTINCT lat, lon, filename, reference_number, locode
+
+    query = text(
+        f"""
+        SELECT DISTINCT {", ".join(columns)}
         FROM asset
         WHERE lat <= :north
         AND lat >= :south
         AND lon <= :east
-        AND lon >= :west;
+        AND lon >= :west
+        {filters};
         """
     )
     params = {"north": north, "south": south, "east": east, "west": west}
+
+    if reference_numbers is not None:
+        query = query.bindparams(bindparam("reference_numbers", expanding=True))
+        params["reference_numbers"] = list(reference_numbers)
+
+    if geometry is not None:
+        params["geometry"] = geometry
+
     result = session.execute(query, params).fetchall()
 
     return result
 
 
+def db_facets_climatetrace(
+    session, geometry, north, south, east, west, reference_numbers=None
+):
+    """count ClimateTRACE assets inside a region per reference_number and locode
+
+    Requires PostGIS, the point-in-polygon test is done in the database.
+
+    Parameters
+    ----------
+    geometry: str
+        region boundary in well-known-text format
+    north, south, east, west: float
+        bounding box of the region
+    reference_numbers: list, optional
+        only count assets of these reference numbers
+
+    Returns
+    -------
+    facets: dict
+        see `split_facets`
+    """
+    sector_filter = ""
+    if reference_numbers is not None:
+        sector_filter = "AND reference_number IN :reference_numbers"
+
+    query = text(
+        f"""
+        WITH "Assets" AS (
+            SELECT DISTINCT lat, lon, filename, reference_number, locode
+            FROM asset
+            WHERE lat <= :north
+            AND lat >= :south
+            AND lon <= :east
+            AND lon >= :west
+            AND ST_Within(
+                ST_SetSRID(ST_MakePoint(lon, lat), 4326),
+                ST_GeomFromText(:geometry, 4326)
+            )
+            {sector_filter}
+        )
+
+        SELECT
+            reference_number,
+            locode,
+            GROUPING(reference_number, locode) AS facet,
+            count(*) AS n
+        FROM "Assets"
+        GROUP BY GROUPING SETS ((reference_number, locode), (reference_number), (locode))
+        ORDER BY facet, reference_number, locode;
+        """
+    )
+    params = {
+        "geometry": geometry,
+        "north": north,
+        "south": south,
+        "east": east,
+        "west": west,
+    }
+
+    if reference_numbers is not None:
+        query = query.bindparams(bindparam("reference_numbers", expanding=True))
+        params["reference_numbers"] = list(reference_numbers)
+
+    result = session.execute(query, params).fetchall()
+
+    return split_facets(result)
+
+
 def db_query_edgar_by_iso(session, iso):
     query = text(
         """
@@ -111,6 +249,205 @@ def db_query_edgar_by_range(session, north, south, east, west):
     return result
 
 
+def db_facets_edgar(
+    session, geometry, north, south, east, west, reference_numbers=None
+):
+    """count EDGAR cells inside a region per reference_number and locode
+
+    Same as `db_facets_climatetrace` for the EDGAR grid cells.
+    """
+    sector_filter = ""
+    if reference_numbers is not None:
+        sector_filter = "WHERE gce.reference_number IN :reference_numbers"
+
+    query = text(
+        f"""
+        WITH "GridCells" AS (
+            SELECT DISTINCT id
+            FROM "GridCellEdgar"
+            WHERE lat_center <= :north
+            AND lat_center >= :south
+            AND lon_center <= :east
+            AND lon_center >= :west
+            AND ST_Within(
+                ST_SetSRID(ST_MakePoint(lon_center, lat_center), 4326),
+                ST_GeomFromText(:geometry, 4326)
+            )
+        )
+
+        SELECT
+            gce.reference_number,
+            cc.locode,
+            GROUPING(gce.reference_number, cc.locode) AS facet,
+            count(DISTINCT gc.id) AS n
+        FROM "GridCells" AS gc
+        JOIN "CityCellOverlapEdgar" AS cc
+            ON gc.id = cc.cell_id
+        JOIN "GridCellEmissionsEdgar" AS gce
+            ON gc.id = gce.cell_id
+        {sector_filter}
+        GROUP BY GROUPING SETS (
+            (gce.reference_number, cc.locode),
+            (gce.reference_number),
+            (cc.locode)
+        )
+        ORDER BY facet, gce.reference_number, cc.locode;
+        """
+    )
+    params = {
+        "geometry": geometry,
+        "north": north,
+        "south": south,
+        "east": east,
+        "west": west,
+    }
+
+    if reference_numbers is not None:
+        query = query.bindparams(bindparam("reference_numbers", expanding=True))
+        params["reference_numbers"] = list(reference_numbers)
+
+    result = session.execute(query, params).fetchall()
+
+    return split_facets(result)
+
+
+def split_facets(rows):
+    """split the rows of a GROUPING SETS facet query
+
+    Parameters
+    ----------
+    rows: list
+        rows with reference_number, locode, facet and n columns, where facet
+        is GROUPING(reference_number, locode)
+
+    Returns
+    -------
+    facets: dict
+        "reference_number": count per reference number,
+        "locode": count per locode,
+        "pairs": list of (reference_number, locode, count)
+    """
+    facets = {"reference_number": {}, "locode": {}, "pairs": []}
+
+    for row in rows:
+        if row.facet == 0:
+            facets["pairs"].append((row.reference_number, row.locode, row.n))
+        elif row.facet == 1:
+            facets["reference_number"][row.reference_number] = row.n
+        elif row.facet == 2:
+            facets["locode"][row.locode] = row.n
+
+    return facets
+
+
+def db_data_versions(session):
+    """data versions of each source in DATA_SOURCES, overall and per country
+
+    The ingest pipeline records each load in a `data_version` watermark table
+
+        CREATE TABLE data_version (
+            id bigserial PRIMARY KEY,
+            source text NOT NULL,
+            region text,
+            loaded_at timestamptz NOT NULL DEFAULT now()
+        );
+
+    with one row per source and affected country (ISO alpha-2 code), or a
+    NULL region when the whole source was reloaded. The versions are the
+    largest ids, so they never repeat.
+
+    Without the table the versions fall back to the row-change counters of
+    the source tables in pg_stat_user_tables, combined with the server start
+    time and the last statistics reset. Those counters don't advance on a
+    read replica and may lag a load, so cached entries can go stale; a
+    warning is logged on every refresh until the table exists.
+
+    Returns
+    -------
+    versions: dict
+        source name to {region: version}, with region None for the whole source
+    """
+    has_watermarks = session.execute(
+        text("SELECT to_regclass('data_version') IS NOT NULL")
+    ).scalar()
+
+    if has_watermarks:
+        query = text(
+            """
+            SELECT source, region, max(id) AS version
+            FROM data_version
+            GROUP BY source, region;
+            """
+        )
+        versions = {source: {} for source in DATA_SOURCES}
+        for row in session.execute(query).fetchall():
+            if row.source in versions:
+                versions[row.source][row.region] = str(row.version)
+
+        return versions
+
+    logger.warning(
+        "the data_version table is missing, cache invalidation falls back to "
+        "pg_stat_user_tables and may serve stale data after a load; create "
+        "the table and record loads in it, see the README"
+    )
+    query = text(
+        """
+        SELECT
+            relname,
+            n_tup_ins + n_tup_upd + n_tup_del AS n_changes,
+            pg_postmaster_start_time() AS started_at,
+            (
+                SELECT stats_reset
+                FROM pg_stat_database
+                WHERE datname = current_database()
+            ) AS stats_reset
+        FROM pg_stat_user_tables
+        WHERE relname IN :tables
+        """
+    ).bindparams(bindparam("tables", expanding=True))
+
+    tables = [table for tables in DATA_SOURCES.values() for table in tables]
+    result = session.execute(query, {"tables": tables}).fetchall()
+    changes = {
+        row.relname: f"{row.started_at}:{row.stats_reset}:{row.n_changes}"
+        for row in result
+    }
+
+    return {
+        source: {None: "|".join(changes.get(table, "0") for table in tables)}
+        for source, tables in DATA_SOURCES.items()
+    }
+
+
+def data_version(versions, source, region_code=None):
+    """version of a source for the country of a region
+
+    Parameters
+    ----------
+    versions: dict
+        as returned by `db_data_versions`
+    source: str
+        key of DATA_SOURCES
+    region_code: str, optional
+        country or state ISO code, or city locode; its first two letters
+        are the country
+
+    Returns
+    -------
+    version: str
+        changes when the whole source or the data of that country is reloaded
+    """
+    source_versions = versions.get(source, {})
+    version = source_versions.get(None, "0")
+
+    if region_code:
+        country = region_code[:2].upper()
+        version = f"{version}|{source_versions.get(country, '0')}"
+
+    return version
+
+
 def locode_data(session, locode):
     query = text(
         """
@@ -121,3 +458,107 @@ def locode_data(session, locode):
     )
     results = session.execute(query, {"locode": locode}).fetchall()
     return results
+
+
+def render_region_figure(
+    lons,
+    lats,
+    polygon,
+    extent,
+    osm_background=True,
+    map_resolution=4,
+    marker_color="red",
+    marker_size=20,
+    edge_color="white",
+    edge_width=0.1,
+):
+    """render points and region boundary to a PNG image
+
+    Parameters
+    ----------
+    lons: list
+        longitude of the points to plot
+    lats: list
+        latitude of the points to plot
+    polygon: shapely geometry
+        region boundary, Polygon or MultiPolygon
+    extent: list
+        [west, east, south, north] of the map
+    osm_background: bool
+        use OpenStreetMap tiles as background instead of land features
+    map_resolution: int
+        zoom level of the background tiles
+
+    Returns
+    -------
+    png: bytes
+        rendered figure
+    """
+    imagery = OSM()
+
+    facecolor = [0, 0, 0]
+    alpha = 0.2
+    central_longitude = 11
+
+    fig = plt.figure(dpi=300)
+
+    if osm_background:
+        projection = imagery.crs
+    else:
+        projection = ccrs.Robinson(central_longitude=central_longitude)
+
+    params_axesgrid = {
+        "rect": [1, 1, 1],
+        "axes_class": (GeoAxes, dict(projection=projection)),
+        "share_all": False,
+        "nrows_ncols": (1, 1),
+        "axes_pad": 0.1,
+        "cbar_location": "bottom",
+        "cbar_mode": None,
+        "cbar_pad": 0.1,
+        "cbar_size": "7%",
+        "label_mode": "",
+    }
+
+    grid = AxesGrid(fig, **params_axesgrid)
+
+    grid[0].scatter(
+        lons,
+        lats,
+        transform=ccrs.PlateCarree(),
+        color=marker_color,
+        marker="o",
+        zorder=2,
+        s=marker_size,
+        edgecolor=edge_color,
+        linewidth=edge_width,
+    )
+
+    grid[0].set_extent(extent, crs=ccrs.PlateCarree())
+
+    polygon_params = {
+        "edgecolor": edge_color,
+        "facecolor": facecolor,
+        "alpha": alpha,
+        "linewidth": 1,
+        "transform": ccrs.PlateCarree(),
+    }
+
+    try:
+        boundary = mplPolygon(polygon.exterior.coords, **polygon_params)
+        grid[0].add_patch(boundary)
+    except AttributeError:
+        for geom in polygon.geoms:
+            boundary = mplPolygon(geom.exterior.coords, **polygon_params)
+            grid[0].add_patch(boundary)
+
+    if osm_background:
+        grid[0].add_image(imagery, map_resolution)
+    else:
+        grid[0].add_feature(cfeature.LAND)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+
+    return buffer.getvalue()